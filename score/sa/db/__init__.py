@@ -26,10 +26,12 @@
 # the Licensee has his registered seat, an establishment or assets.
 
 
-from ._init import init, ConfiguredSaDbModule, engine_from_config
+from ._init import (
+    init, ConfiguredSaDbModule, engine_from_config, DeadlineExceeded)
 from ._enum import Enum, EnumType
 
 __version__ = '0.2.1'
 
 __all__ = (
-    'init', 'ConfiguredSaDbModule', 'engine_from_config', 'Enum', 'EnumType')
+    'init', 'ConfiguredSaDbModule', 'engine_from_config', 'DeadlineExceeded',
+    'Enum', 'EnumType')
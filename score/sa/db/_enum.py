@@ -42,7 +42,14 @@ class Enum(enum.Enum):
 
     def __init__(self, *args):
         cls = self.__class__
-        if any(self.value == e.value for e in cls):
+        # python's enum machinery fills _value2member_map_ while constructing
+        # the class, so this lookup only sees the members defined so far.
+        try:
+            duplicate = self.value in cls._value2member_map_
+        except TypeError:
+            # unhashable values are not stored in the map
+            duplicate = any(self.value == e.value for e in cls)
+        if duplicate:
             a = self.name
             e = cls(self.value).name
             raise ValueError(
@@ -50,33 +57,40 @@ class Enum(enum.Enum):
                 % (a, e))
 
     @classmethod
-    def db_type(cls):
+    def db_type(cls, create_type=True):
         """
         Returns the SQLAlchemy type to use for storing values of this enum in
         the database.
+
+        Passing a falsy *create_type* prevents SQLAlchemy from creating the
+        native enum type during :meth:`sqlalchemy.schema.MetaData.create_all`,
+        which is useful in combination with
+        :func:`score.sa.db.pg.create_enum_types`.
         """
-        return EnumType(cls)
+        return EnumType(cls, create_type=create_type)
 
 
 class EnumType(SchemaType, TypeDecorator):
 
     cache_ok = True
 
-    def __init__(self, enum):
+    def __init__(self, enum, create_type=True):
         self.enum = enum
+        self.create_type = create_type
         self.impl = SAEnum(
             *[sym.value for sym in enum],
             name="enum%s" % re.sub(
                 '([A-Z])',
                 lambda m: "_" + m.group(1).lower(),
-                enum.__name__)
+                enum.__name__),
+            create_type=create_type
         )
 
     def _set_table(self, table, column):
         self.impl._set_table(table, column)
 
     def copy(self):
-        return EnumType(self.enum)
+        return EnumType(self.enum, create_type=self.create_type)
 
     def process_bind_param(self, value, dialect):
         if value is None:
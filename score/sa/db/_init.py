@@ -25,15 +25,27 @@
 # the discretion of STRG.AT GmbH also the competent court, in whose district
 # the Licensee has his registered seat, an establishment or assets.
 
+import re
+import threading
+import time
+import weakref
 import sqlalchemy as sa
+from sqlalchemy.engine.default import CACHE_HIT, CACHE_MISS
 from score.init import (
-    ConfiguredModule, parse_dotted_path, parse_bool, parse_call)
+    ConfiguredModule, parse_dotted_path, parse_bool, parse_call,
+    parse_time_interval)
 
 
 defaults = {
     'destroyable': False,
     'ctx.member': 'db',
     'ctx.transaction': True,
+    'ctx.read_member': None,
+    'ctx.timeout': None,
+    'statement_cache.stats': False,
+    'sqlite.single_writer': False,
+    'sqlite.lock_file': None,
+    'sqlite.writer_timeout': '30s',
 }
 
 
@@ -73,58 +85,464 @@ def init(confdict, ctx=None):
 
         This value is only relevant if *ctx.member* is not `None`.
 
+    :confkey:`ctx.read_member` :confdefault:`None`
+        The name of an additional :term:`context member` providing an
+        :class:`sqlalchemy.engine.Connection` for read-only access. The
+        connection is taken from :attr:`ConfiguredSaDbModule.read_engine`, if
+        *sqlite.single_writer* is enabled, and from the regular engine
+        otherwise. It is never wrapped in a transaction.
+
+        This value is only relevant, if the optional :mod:`score.ctx`
+        dependency was configured.
+
+    :confkey:`ctx.timeout` :confdefault:`None`
+        Default time interval (as parsed by
+        :func:`score.init.parse_time_interval`) a context may use its database
+        connection, measured from the moment the connection is first
+        requested. The resulting deadline is enforced as a per-transaction
+        ``statement_timeout`` on postgresql and by interrupting running
+        queries on sqlite. A lower ``statement_timeout`` configured for the
+        session (see :confkey:`session.*`) remains in effect. Waiting for a
+        pooled connection is limited to the deadline as well, and requesting
+        the connection after the deadline has passed raises
+        :class:`DeadlineExceeded`. The deadline of a single context can be
+        changed with :meth:`ConfiguredSaDbModule.set_timeout`.
+
+        Limiting the wait for a pooled connection is not possible, if a pool
+        instance was configured via ``sqlalchemy.pool``.
+
+        Note that postgresql only supports transaction-local timeouts, so
+        running queries are not interrupted on postgresql, if
+        *ctx.transaction* is disabled.
+
+    :confkey:`statement_cache.stats` :confdefault:`False`
+        Whether hits and misses of SQLAlchemy's compiled statement cache
+        should be counted. The size of the cache itself can be configured
+        with ``sqlalchemy.query_cache_size``. See
+        :meth:`ConfiguredSaDbModule.statement_cache_stats`.
+
+    :confkey:`sqlite.single_writer` :confdefault:`False`
+        Whether all write transactions on an SQLite database should be
+        serialized through a single writer connection. See
+        :class:`score.sa.db.sqlite.SingleWriter` for details.
+
+        In this mode, :attr:`ConfiguredSaDbModule.engine` provides the
+        writer connection and :attr:`ConfiguredSaDbModule.read_engine` a pool
+        of read-only connections. The context member *ctx.member* always
+        holds the writer connection, so contexts that only read should use
+        the member configured as *ctx.read_member* instead, which does not
+        wait for writers.
+
+    :confkey:`sqlite.lock_file` :confdefault:`None`
+        Path to a file, that will be locked while a process holds the writer
+        connection. Configure this, if multiple processes write to the same
+        database. Only relevant if *sqlite.single_writer* is enabled.
+
+    :confkey:`sqlite.writer_timeout` :confdefault:`30s`
+        Maximum time to wait for the writer connection. Only relevant if
+        *sqlite.single_writer* is enabled.
+
+    :confkey:`session.*`
+        Session parameters to set on every new database connection. The
+        parameters are applied once, when the pool creates a new DBAPI
+        connection (i.e. also after a connection was invalidated), instead of
+        at the start of each context. Example::
+
+            session.search_path = myapp, public
+            session.timezone = UTC
+            session.application_name = myapp
+
+        These are set using ``set_config()`` on postgresql, ``PRAGMA`` on
+        sqlite and ``SET`` on all other databases. See
+        :meth:`ConfiguredSaDbModule.set_local` for overriding parameters in a
+        single context.
+
     """
     conf = defaults.copy()
     conf.update(confdict)
-    engine = engine_from_config(conf)
+    read_engine = None
+    if parse_bool(conf['sqlite.single_writer']):
+        from .sqlite import SingleWriter
+        writer = SingleWriter(
+            conf, lock_file=conf['sqlite.lock_file'] or None,
+            timeout=parse_time_interval(conf['sqlite.writer_timeout']))
+        engine = writer.writer_engine
+        read_engine = writer.read_engine
+    else:
+        engine = engine_from_config(conf)
+    session_settings = dict(
+        (key[len('session.'):], value)
+        for key, value in conf.items()
+        if key.startswith('session.'))
+    if session_settings:
+        for engine_ in (engine, read_engine):
+            if engine_ is not None:
+                _register_session_settings(engine_, session_settings)
+    statement_cache_stats = None
+    if parse_bool(conf['statement_cache.stats']):
+        statement_cache_stats = [
+            StatementCacheStats(engine_)
+            for engine_ in (engine, read_engine)
+            if engine_ is not None]
     ctx_member = None
     if conf['ctx.member'] and conf['ctx.member'] != 'None':
         ctx_member = conf['ctx.member']
     if conf['ctx.transaction']:
         ctx_transaction = parse_bool(conf['ctx.transaction'])
+    ctx_read_member = None
+    if conf['ctx.read_member'] and conf['ctx.read_member'] != 'None':
+        ctx_read_member = conf['ctx.read_member']
+    ctx_timeout = None
+    if conf['ctx.timeout'] and conf['ctx.timeout'] != 'None':
+        ctx_timeout = parse_time_interval(conf['ctx.timeout'])
+    custom_pool = 'sqlalchemy.pool' in conf
     return ConfiguredSaDbModule(
         ctx, engine, parse_bool(conf['destroyable']),
-        ctx_member, ctx_transaction)
+        ctx_member, ctx_transaction, read_engine=read_engine,
+        session_settings=session_settings, ctx_timeout=ctx_timeout,
+        statement_cache_stats=statement_cache_stats,
+        ctx_read_member=ctx_read_member, custom_pool=custom_pool)
+
+
+class DeadlineExceeded(sa.exc.TimeoutError):
+    """
+    Raised when a :class:`score.ctx.Context` requests its database connection
+    after its deadline has passed, or if the deadline passes while waiting for
+    a pooled connection.
+    """
+
+
+# state of the connection checkout currently performed in this thread, see
+# _checkout_timeout()
+_checkout = threading.local()
+
+
+def _checkout_timeout(timeout):
+    """
+    Returns given checkout *timeout*, lowered to the time remaining until the
+    deadline of the context currently checking out a connection in this
+    thread.
+    """
+    deadline = getattr(_checkout, 'deadline', None)
+    if deadline is None:
+        return timeout
+    remaining = max(0, deadline - time.monotonic())
+    if timeout is None or remaining < timeout:
+        _checkout.capped = True
+        return remaining
+    return timeout
+
+
+_deadline_aware_pool_classes = dict()
+
+
+def _make_deadline_aware(pool):
+    """
+    Makes the checkout timeout of given *pool* respect the deadline of the
+    context requesting the connection (see :func:`_checkout_timeout`).
+
+    SQLAlchemy only supports a single timeout per pool, so the pool's class is
+    replaced with a subclass, that reads its *_timeout* through a property.
+    Pools without a checkout timeout are left unchanged.
+
+    This relies on SQLAlchemy internals: :class:`sqlalchemy.pool.QueuePool`
+    stores the timeout as *_timeout* and reads it in ``_do_get()`` whenever
+    it waits for a connection. ``recreate()`` passes *_timeout* to the new
+    pool, which is why the subclass overrides it to pass the configured value
+    instead of a capped one.
+    """
+    cls = type(pool)
+    if cls in _deadline_aware_pool_classes.values():
+        return
+    if '_timeout' not in vars(pool):
+        return
+    if cls not in _deadline_aware_pool_classes:
+
+        def get_timeout(self):
+            return _checkout_timeout(self.__dict__['_timeout'])
+
+        def set_timeout(self, value):
+            self.__dict__['_timeout'] = value
+
+        def recreate(self):
+            pool = super(subclass, self).recreate()
+            pool.__dict__['_timeout'] = self.__dict__['_timeout']
+            return pool
+
+        subclass = type('DeadlineAware' + cls.__name__, (cls,), {
+            '_timeout': property(get_timeout, set_timeout),
+            'recreate': recreate,
+        })
+        _deadline_aware_pool_classes[cls] = subclass
+    pool.__class__ = _deadline_aware_pool_classes[cls]
+
+
+# key in the pool's connection info, under which the session's
+# statement_timeout is cached, see ConfiguredSaDbModule._apply_deadline()
+_statement_timeout_key = 'score.sa.db.statement_timeout'
+
+
+# applies the deadline and returns the session's statement_timeout in a
+# single round trip. pg_settings still contains the session's value, since
+# this runs before any transaction-local timeout was set.
+_deadline_sql = sa.text("""
+    SELECT setting, set_config('statement_timeout', CASE
+        WHEN :timeout IS NULL THEN setting
+        WHEN setting::integer = 0 OR setting::integer > :timeout
+            THEN CAST(:timeout AS text)
+        ELSE setting
+    END, true)
+    FROM pg_catalog.pg_settings
+    WHERE name = 'statement_timeout'
+""").bindparams(sa.bindparam('timeout', type_=sa.Integer))
+
+
+_session_parameter_regex = re.compile(r'^[A-Za-z_][A-Za-z0-9_.]*$')
+
+
+def _session_statements(dialect, settings):
+    """
+    Returns the SQL statements for applying given session *settings* on
+    connections of given *dialect* as a list of ``(statement, parameters)``
+    tuples. The *parameters* are in the dialect's paramstyle, or `None` if
+    the statement must be executed without parameters.
+    """
+    statements = []
+    for name, value in settings.items():
+        if not _session_parameter_regex.match(name):
+            raise ValueError('Invalid session parameter name: %r' % name)
+        if dialect.name == 'postgresql':
+            query = sa.select(sa.func.set_config(name, str(value), False))
+            compiled = query.compile(dialect=dialect)
+            parameters = compiled.construct_params()
+            if dialect.positional:
+                parameters = tuple(
+                    parameters[key] for key in compiled.positiontup)
+            statements.append((str(compiled), parameters))
+        elif dialect.name == 'sqlite':
+            statements.append(('PRAGMA %s = %s' % (name, value), None))
+        else:
+            statements.append(('SET %s = %s' % (name, value), None))
+    return statements
+
+
+def _register_session_settings(engine, settings):
+    """
+    Registers a listener on given *engine*, that applies the session
+    *settings* whenever the pool creates a new DBAPI connection.
+    """
+    statements = _session_statements(engine.dialect, settings)
+
+    @sa.event.listens_for(engine, 'connect')
+    def apply_session_settings(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for statement, parameters in statements:
+                if parameters is None:
+                    cursor.execute(statement)
+                else:
+                    cursor.execute(statement, parameters)
+        finally:
+            cursor.close()
+        dbapi_connection.commit()
 
 
 _registered_utf8mb4 = False
 
 
-def engine_from_config(config):
+def _parse_echo(value):
+    if isinstance(value, str) and value.lower() == 'debug':
+        return 'debug'
+    return parse_bool(value)
+
+
+def _parse_choice(*choices):
+    def parse(value):
+        if value not in choices:
+            raise ValueError('must be one of %s' % ', '.join(choices))
+        return value
+    return parse
+
+
+def _parse_non_negative_int(value):
+    value = int(value)
+    if value < 0:
+        raise ValueError('must not be negative')
+    return value
+
+
+def _parse_seconds(value):
+    value = float(value)
+    if value < 0:
+        raise ValueError('must not be negative')
+    return value
+
+
+# converters for configuration values under the "sqlalchemy." prefix, that
+# should not be passed to sqlalchemy as strings
+_engine_options = {
+    'echo': _parse_echo,
+    'echo_pool': _parse_echo,
+    'case_sensitive': parse_bool,
+    'hide_parameters': parse_bool,
+    'module': parse_dotted_path,
+    'poolclass': parse_dotted_path,
+    'pool': parse_call,
+    'pool_size': _parse_non_negative_int,
+    'max_overflow': int,
+    'pool_recycle': int,
+    'pool_timeout': _parse_seconds,
+    'pool_pre_ping': parse_bool,
+    'pool_use_lifo': parse_bool,
+    'pool_reset_on_return': _parse_choice('rollback', 'commit', 'none'),
+    'query_cache_size': _parse_non_negative_int,
+    'use_insertmanyvalues': parse_bool,
+    'insertmanyvalues_page_size': _parse_non_negative_int,
+    'executemany_mode': _parse_choice('values_only', 'values_plus_batch'),
+    'executemany_batch_page_size': _parse_non_negative_int,
+}
+
+
+def engine_from_config(config, **kwargs):
     """
     A wrapper around :func:`sqlalchemy.engine_from_config`, that converts
-    certain configuration values. Currently, the following configurations are
-    processed:
-
-    - ``sqlalchemy.echo`` (using :func:`score.init.parse_bool`)
-    - ``sqlalchemy.echo_pool`` (using :func:`score.init.parse_bool`)
-    - ``sqlalchemy.case_sensitive`` (using :func:`score.init.parse_bool`)
-    - ``sqlalchemy.module`` (using :func:`score.init.parse_dotted_path`)
-    - ``sqlalchemy.poolclass`` (using :func:`score.init.parse_dotted_path`)
+    certain configuration values. Any *kwargs* are passed to
+    :func:`sqlalchemy.create_engine` as-is and take precedence over the
+    values in *config*. Values of options not listed below are coerced using
+    the dialect's ``engine_config_types``, just like
+    :func:`sqlalchemy.engine_from_config` would do. Currently, the following
+    configurations are processed:
+
+    - ``sqlalchemy.echo`` and ``sqlalchemy.echo_pool`` (the string ``debug``
+      or a value for :func:`score.init.parse_bool`)
+    - ``sqlalchemy.case_sensitive``, ``sqlalchemy.hide_parameters``,
+      ``sqlalchemy.pool_pre_ping``, ``sqlalchemy.pool_use_lifo`` and
+      ``sqlalchemy.use_insertmanyvalues`` (using
+      :func:`score.init.parse_bool`)
+    - ``sqlalchemy.module`` and ``sqlalchemy.poolclass`` (using
+      :func:`score.init.parse_dotted_path`)
     - ``sqlalchemy.pool`` (using :func:`score.init.parse_call`)
-    - ``sqlalchemy.pool_size`` (converted to `int`)
-    - ``sqlalchemy.pool_recycle`` (converted to `int`)
+    - ``sqlalchemy.pool_size``, ``sqlalchemy.query_cache_size``,
+      ``sqlalchemy.insertmanyvalues_page_size`` and
+      ``sqlalchemy.executemany_batch_page_size`` (converted to non-negative
+      `int`)
+    - ``sqlalchemy.max_overflow`` and ``sqlalchemy.pool_recycle`` (converted
+      to `int`)
+    - ``sqlalchemy.pool_timeout`` (converted to non-negative `float`)
+    - ``sqlalchemy.pool_reset_on_return`` (one of ``rollback``, ``commit``
+      or ``none``)
+    - ``sqlalchemy.executemany_mode`` (one of ``values_only`` or
+      ``values_plus_batch``)
+
+    Invalid values raise a :class:`ValueError` mentioning the offending key.
     """
     global _registered_utf8mb4
-    conf = dict()
+    options = dict()
+    converted = set()
     for key in config:
-        if key in ('sqlalchemy.echo', 'sqlalchemy.echo_pool',
-                   'sqlalchemy.case_sensitive'):
-            conf[key] = parse_bool(config[key])
-        elif key in ('sqlalchemy.module', 'sqlalchemy.poolclass'):
-            conf[key] = parse_dotted_path(config[key])
-        elif key == 'sqlalchemy.pool':
-            conf[key] = parse_call(config[key])
-        elif key in ('sqlalchemy.pool_size', 'sqlalchemy.pool_recycle'):
-            conf[key] = int(config[key])
-        else:
-            conf[key] = config[key]
-    if not _registered_utf8mb4 and 'utf8mb4' in conf.get('sqlalchemy.url', ''):
+        if not key.startswith('sqlalchemy.'):
+            continue
+        option = key[len('sqlalchemy.'):]
+        if option not in _engine_options:
+            options[option] = config[key]
+            continue
+        try:
+            options[option] = _engine_options[option](config[key])
+        except (ValueError, TypeError) as e:
+            raise ValueError('Invalid value for %s: %r (%s)' % (
+                key, config[key], e)) from e
+        converted.add(option)
+    url = options.pop('url')
+    if not _registered_utf8mb4 and 'utf8mb4' in str(url):
         import codecs
         codecs.register(lambda name: codecs.lookup('utf8')
                         if name == 'utf8mb4' else None)
         _registered_utf8mb4 = True
-    return sa.engine_from_config(conf)
+    # sqlalchemy.engine_from_config() would coerce all values using the
+    # dialect's engine_config_types, which truncates our float pool_timeout
+    # to an int. We only let the dialect coerce the values we did not convert.
+    config_types = sa.engine.make_url(url).get_dialect().engine_config_types
+    for option in set(options) - converted:
+        if option in config_types:
+            options[option] = config_types[option](options[option])
+    options.update(kwargs)
+    return sa.create_engine(url, **options)
+
+
+class StatementCacheStats:
+    """
+    Counts hits, misses and evictions of SQLAlchemy's compiled statement cache
+    on an :class:`sqlalchemy.engine.Engine`. See
+    :meth:`ConfiguredSaDbModule.statement_cache_stats`.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.hits = 0
+        self.misses = 0
+        self.uncached = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        # after_execute fires once per statement, while after_cursor_execute
+        # would fire once per batch of an "insertmanyvalues" execution.
+        # after_execute is not fired for exec_driver_sql(), though, so these
+        # are counted in after_cursor_execute.
+        sa.event.listen(engine, 'after_execute', self._count)
+        sa.event.listen(engine, 'after_cursor_execute', self._count_driver_sql)
+        cache = getattr(engine, '_compiled_cache', None)
+        if cache is not None:
+            self._size_alert = cache.size_alert
+            cache.size_alert = self._count_evictions
+
+    def _count(self, connection, clauseelement, multiparams, params,
+               execution_options, result):
+        context = getattr(result, 'context', None)
+        cache_hit = getattr(context, 'cache_hit', None)
+        if cache_hit is None:
+            return
+        with self._lock:
+            if cache_hit == CACHE_HIT:
+                self.hits += 1
+            elif cache_hit == CACHE_MISS:
+                self.misses += 1
+            else:
+                self.uncached += 1
+
+    def _count_driver_sql(self, connection, cursor, statement, parameters,
+                          context, executemany):
+        if context is None or context.compiled is not None:
+            return
+        with self._lock:
+            self.uncached += 1
+
+    def _count_evictions(self, cache):
+        # the cache calls this function right before it prunes itself down
+        # to its capacity
+        with self._lock:
+            self.evictions += max(0, len(cache) - cache.capacity)
+        if self._size_alert:
+            self._size_alert(cache)
+
+    @property
+    def size(self):
+        cache = getattr(self.engine, '_compiled_cache', None)
+        return 0 if cache is None else len(cache)
+
+    @property
+    def capacity(self):
+        cache = getattr(self.engine, '_compiled_cache', None)
+        return 0 if cache is None else cache.capacity
+
+    def as_dict(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'uncached': self.uncached,
+                'evictions': self.evictions,
+                'size': self.size,
+                'capacity': self.capacity,
+            }
 
 
 class ConfiguredSaDbModule(ConfiguredModule):
@@ -133,18 +551,36 @@ class ConfiguredSaDbModule(ConfiguredModule):
     <score.init.ConfiguredModule>`.
     """
 
-    def __init__(self, ctx, engine, destroyable, ctx_member, ctx_transaction):
+    def __init__(self, ctx, engine, destroyable, ctx_member, ctx_transaction,
+                 *, read_engine=None, session_settings=None,
+                 ctx_timeout=None, statement_cache_stats=None,
+                 ctx_read_member=None, custom_pool=False):
         super().__init__(__package__)
         self.ctx = ctx
         self.engine = engine
+        self.read_engine = read_engine
+        self.session_settings = session_settings or {}
         self.destroyable = destroyable
         self.ctx_member = ctx_member
         self.ctx_transaction = ctx_transaction
+        self.ctx_read_member = ctx_read_member
+        self.ctx_timeout = ctx_timeout
+        self._statement_cache_stats = statement_cache_stats
         self.__ctx_connections = dict()
+        self.__ctx_read_connections = dict()
+        self.__ctx_deadlines = weakref.WeakKeyDictionary()
+        self.__ctx_parents = weakref.WeakKeyDictionary()
+        self.custom_pool = custom_pool
+        if ctx_timeout is not None:
+            self._enable_deadline_checkout()
         if ctx and ctx_member:
             ctx.register(ctx_member,
                          self._create_connection,
                          destructor=self._close_connection)
+        if ctx and ctx_read_member:
+            ctx.register(ctx_read_member,
+                         self._create_read_connection,
+                         destructor=self._close_read_connection)
 
     def get_connection(self, ctx):
         """
@@ -156,20 +592,280 @@ class ConfiguredSaDbModule(ConfiguredModule):
         assert isinstance(ctx, self.ctx.Context)
         return getattr(ctx, self.ctx_member)
 
+    def get_read_connection(self, ctx):
+        """
+        Provides a read-only :class:`sqlalchemy.engine.Connection` for given
+        :class:`score.ctx.Context` object. See :confkey:`ctx.read_member`.
+        """
+        assert isinstance(ctx, self.ctx.Context)
+        return getattr(ctx, self.ctx_read_member)
+
+    def set_parent(self, ctx, parent):
+        """
+        Makes given :class:`score.ctx.Context` object *ctx* share the database
+        connection of the context *parent*, instead of checking out a
+        connection of its own. Must be called before *ctx* accesses its
+        connection for the first time.
+
+        If *ctx.transaction* is enabled, the child context operates inside a
+        SAVEPOINT, which is released at the end of the child's lifetime (or
+        rolled back, if the child was terminated with an exception). The
+        outer transaction is only committed by the root context.
+
+        Since both contexts use the same connection, the child must be used
+        in the same thread as its parent and must be destroyed before it.
+        Sibling contexts must not be interleaved, as savepoints can only be
+        released in reverse order of their creation.
+        """
+        if ctx in self.__ctx_connections:
+            raise ValueError('Context already has a connection')
+        self.__ctx_parents[ctx] = parent
+
+    def statement_cache_stats(self):
+        """
+        Returns a dict describing the usage of SQLAlchemy's compiled statement
+        cache since the module was initialized:
+
+        - ``hits``: number of executions that used a cached statement,
+        - ``misses``: number of executions that had to compile a statement,
+        - ``uncached``: number of executions that could not be cached (plain
+          SQL strings or constructs without a cache key, for example),
+        - ``evictions``: number of statements that were removed from the
+          cache due to its size limit. The cache is only pruned once it
+          exceeds its capacity by 50%, so this value grows in steps,
+        - ``size`` and ``capacity``: current and maximum number of cached
+          statements.
+
+        A high number of evictions indicates that the application generates
+        more distinct statements than ``sqlalchemy.query_cache_size`` allows.
+
+        This requires :confkey:`statement_cache.stats` to be enabled.
+        """
+        if self._statement_cache_stats is None:
+            raise ValueError('Statement cache statistics are not enabled')
+        result = dict.fromkeys(
+            ('hits', 'misses', 'uncached', 'evictions', 'size', 'capacity'), 0)
+        for stats in self._statement_cache_stats:
+            for key, value in stats.as_dict().items():
+                result[key] += value
+        return result
+
+    def apply_session_settings(self, connection):
+        """
+        Applies the configured :confkey:`session.*` parameters on given
+        :class:`sqlalchemy.engine.Connection`. The parameters are applied
+        automatically to every new connection, so this is only necessary if
+        the application reset the session state of a pooled connection (using
+        ``RESET ALL`` or ``DISCARD ALL``, for example).
+        """
+        connection.connection.info.pop(_statement_timeout_key, None)
+        for statement, parameters in _session_statements(
+                connection.dialect, self.session_settings):
+            if parameters is None:
+                connection.exec_driver_sql(
+                    statement, execution_options={'no_parameters': True})
+            else:
+                connection.exec_driver_sql(statement, parameters)
+
+    def set_local(self, ctx, name, value):
+        """
+        Overrides the session parameter *name* for the transaction of given
+        :class:`score.ctx.Context` object. The value will be reset
+        automatically when the context's transaction ends, so the pooled
+        connection retains its configured :confkey:`session.*` parameters.
+
+        This is implemented using ``SET LOCAL`` semantics and thus only
+        available on postgresql databases with *ctx.transaction* enabled.
+        """
+        if not self.ctx_transaction:
+            raise ValueError('Local session parameters require a transaction')
+        connection = self.get_connection(ctx)
+        if connection.dialect.name != 'postgresql':
+            raise NotImplementedError(
+                'Local session parameters are only supported on postgresql')
+        if not _session_parameter_regex.match(name):
+            raise ValueError('Invalid session parameter name: %r' % name)
+        connection.execute(
+            sa.select(sa.func.set_config(name, str(value), True)))
+
+    def set_timeout(self, ctx, timeout):
+        """
+        Sets the deadline of given :class:`score.ctx.Context` object to
+        *timeout* seconds from now, overriding the configured
+        :confkey:`ctx.timeout`. A *timeout* of `None` removes the deadline.
+
+        If the context already has connections of its own, the new deadline
+        will be applied to them immediately. Contexts
+        sharing their parent's connection (see :meth:`set_parent`) only check
+        their deadline when they request the connection.
+        """
+        if timeout is None:
+            self.__ctx_deadlines[ctx] = None
+        else:
+            self._enable_deadline_checkout()
+            self.__ctx_deadlines[ctx] = time.monotonic() + timeout
+        if ctx in self.__ctx_connections and \
+                not self.__ctx_connections[ctx]['shared']:
+            self._apply_deadline(ctx, self.__ctx_connections[ctx])
+        if ctx in self.__ctx_read_connections:
+            self._apply_deadline(ctx, self.__ctx_read_connections[ctx])
+
+    def get_deadline(self, ctx):
+        """
+        Returns the deadline of given :class:`score.ctx.Context` object as a
+        value of :func:`time.monotonic`, or `None` if the context has no
+        deadline.
+        """
+        if ctx not in self.__ctx_deadlines:
+            if self.ctx_timeout is None:
+                return None
+            self.__ctx_deadlines[ctx] = time.monotonic() + self.ctx_timeout
+        return self.__ctx_deadlines[ctx]
+
+    def _enable_deadline_checkout(self):
+        """
+        Makes the pools of our engines limit the wait for a connection to the
+        deadline of the requesting context. Pools configured by the user are
+        left untouched.
+        """
+        if self.custom_pool:
+            return
+        for engine in (self.engine, self.read_engine):
+            if engine is not None:
+                _make_deadline_aware(engine.pool)
+
+    def _check_deadline(self, ctx):
+        deadline = self.get_deadline(ctx)
+        if deadline is None:
+            return None
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise DeadlineExceeded('Deadline of context %r exceeded' % ctx)
+        return remaining
+
+    def _apply_deadline(self, ctx, entry):
+        remaining = self._check_deadline(ctx)
+        connection = entry['connection']
+        if connection.dialect.name == 'postgresql':
+            if entry['transaction'] is None:
+                return
+            deadline_timeout = None
+            if remaining is not None:
+                deadline_timeout = max(1, int(remaining * 1000))
+            # the session's timeout in milliseconds, 0 means no timeout
+            info = connection.connection.info
+            if _statement_timeout_key not in info:
+                session_timeout, _ = connection.execute(
+                    _deadline_sql, {'timeout': deadline_timeout}).one()
+                info[_statement_timeout_key] = int(session_timeout)
+                return
+            timeout = info[_statement_timeout_key]
+            if deadline_timeout is not None:
+                if not timeout or deadline_timeout < timeout:
+                    timeout = deadline_timeout
+            connection.execute(sa.select(
+                sa.func.set_config('statement_timeout', str(timeout), True)))
+        elif connection.dialect.name == 'sqlite':
+            dbapi_connection = connection.connection.dbapi_connection
+            if remaining is None:
+                dbapi_connection.set_progress_handler(None, 0)
+                return
+            deadline = self.get_deadline(ctx)
+
+            def interrupt():
+                return time.monotonic() > deadline
+            dbapi_connection.set_progress_handler(interrupt, 1000)
+
     def _create_connection(self, ctx):
-        if ctx not in self.__ctx_connections:
-            connection = self.engine.connect()
-            transaction = None
-            if self.ctx_transaction:
-                transaction = connection.begin()
+        if ctx not in self.__ctx_connections and ctx in self.__ctx_parents:
+            self._check_deadline(ctx)
+            connection = self.get_connection(self.__ctx_parents[ctx])
+            savepoint = None
+            if self.ctx_transaction and connection.in_transaction():
+                savepoint = connection.begin_nested()
             self.__ctx_connections[ctx] = {
                 'connection': connection,
-                'transaction': transaction,
+                'transaction': savepoint,
+                'shared': True,
             }
+        if ctx not in self.__ctx_connections:
+            connection = self._connect(ctx, self.engine)
+            entry = {
+                'connection': connection,
+                'transaction': None,
+                'shared': False,
+            }
+            try:
+                if self.ctx_transaction:
+                    entry['transaction'] = connection.begin()
+                if self.get_deadline(ctx) is not None:
+                    self._apply_deadline(ctx, entry)
+            except Exception:
+                connection.close()
+                raise
+            self.__ctx_connections[ctx] = entry
         return self.__ctx_connections[ctx]['connection']
 
+    def _create_read_connection(self, ctx):
+        if ctx not in self.__ctx_read_connections:
+            engine = self.read_engine
+            if engine is None:
+                engine = self.engine
+            connection = self._connect(ctx, engine)
+            entry = {
+                'connection': connection,
+                'transaction': None,
+                'shared': False,
+            }
+            try:
+                if self.get_deadline(ctx) is not None:
+                    self._apply_deadline(ctx, entry)
+            except Exception:
+                connection.close()
+                raise
+            self.__ctx_read_connections[ctx] = entry
+        return self.__ctx_read_connections[ctx]['connection']
+
+    def _close_read_connection(self, ctx, connection, exception):
+        try:
+            if connection.dialect.name == 'sqlite' and \
+                    self.get_deadline(ctx) is not None:
+                connection.connection.dbapi_connection.set_progress_handler(
+                    None, 0)
+        finally:
+            connection.close()
+            del self.__ctx_read_connections[ctx]
+
+    def _connect(self, ctx, engine):
+        """
+        Checks out a connection from given *engine*, waiting no longer than
+        the deadline of given :class:`score.ctx.Context` object.
+        """
+        deadline = self.get_deadline(ctx)
+        self._check_deadline(ctx)
+        _checkout.deadline = deadline
+        _checkout.capped = False
+        try:
+            return engine.connect()
+        except sa.exc.TimeoutError as e:
+            if _checkout.capped:
+                raise DeadlineExceeded(
+                    'Deadline of context %r exceeded while waiting for a '
+                    'connection' % ctx) from e
+            raise
+        finally:
+            _checkout.deadline = None
+            _checkout.capped = False
+
     def _close_connection(self, ctx, connection, exception):
+        if self.__ctx_connections[ctx]['shared']:
+            self._release_shared_connection(ctx, exception)
+            return
         try:
+            if connection.dialect.name == 'sqlite' and \
+                    self.get_deadline(ctx) is not None:
+                connection.connection.dbapi_connection.set_progress_handler(
+                    None, 0)
             transaction = self.__ctx_connections[ctx]['transaction']
             if transaction:
                 if exception:
@@ -180,6 +876,17 @@ class ConfiguredSaDbModule(ConfiguredModule):
             connection.close()
             del self.__ctx_connections[ctx]
 
+    def _release_shared_connection(self, ctx, exception):
+        try:
+            savepoint = self.__ctx_connections[ctx]['transaction']
+            if savepoint and savepoint.is_active:
+                if exception:
+                    savepoint.rollback()
+                else:
+                    savepoint.commit()
+        finally:
+            del self.__ctx_connections[ctx]
+
     def destroy(self, connection=None):
         """
         .. note::
@@ -197,6 +904,8 @@ class ConfiguredSaDbModule(ConfiguredModule):
             from .sqlite import destroy
         else:
             raise Exception('Can only destroy sqlite and postgresql databases')
-        if connection is None:
-            connection = self.engine.connect()
-        destroy(connection, self.destroyable)
+        if connection is not None:
+            destroy(connection, self.destroyable)
+            return
+        with self.engine.connect() as connection:
+            destroy(connection, self.destroyable)
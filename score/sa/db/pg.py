@@ -29,62 +29,246 @@
 Provides functions specific to PostgreSQL databases.
 """
 
+import collections
 import logging
-import transaction
+import sqlalchemy as sa
 
 log = logging.getLogger(__name__)
 
 
-def list_views(connection):
+CatalogSnapshot = collections.namedtuple('CatalogSnapshot', (
+    'marker', 'tables', 'views', 'materialized_views', 'sequences',
+    'enum_types'))
+CatalogSnapshot.__doc__ = """
+Result of :func:`introspect`. All members except *marker* are lists of
+``(schema, name)`` tuples. The *marker* is the value of
+:func:`catalog_marker` at the time the snapshot was created.
+"""
+
+
+# maps pg_class.relkind (and 'e' for enum types) to CatalogSnapshot members
+_relkinds = {
+    'r': 'tables',
+    'p': 'tables',
+    'v': 'views',
+    'm': 'materialized_views',
+    'S': 'sequences',
+    'e': 'enum_types',
+}
+
+
+_catalog_sql = sa.text("""
+    SELECT n.nspname, c.relname, c.relkind::text
+    FROM pg_catalog.pg_class c
+    JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = ANY(:schemas)
+      AND c.relkind IN ('r', 'p', 'v', 'm', 'S')
+    UNION ALL
+    SELECT n.nspname, t.typname, 'e'
+    FROM pg_catalog.pg_type t
+    JOIN pg_catalog.pg_namespace n ON n.oid = t.typnamespace
+    WHERE n.nspname = ANY(:schemas)
+      AND t.typtype = 'e'
+    ORDER BY 1, 2
+""")
+
+
+_catalog_marker_sql = sa.text("""
+    SELECT current_database(), (
+        SELECT count(*) || ':' || coalesce(max(c.xmin::text::bigint), 0)
+        FROM pg_catalog.pg_class c
+        JOIN pg_catalog.pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = ANY(:schemas)
+    ), (
+        SELECT count(*) || ':' || coalesce(max(t.xmin::text::bigint), 0)
+        FROM pg_catalog.pg_type t
+        JOIN pg_catalog.pg_namespace n ON n.oid = t.typnamespace
+        WHERE n.nspname = ANY(:schemas)
+    )
+""")
+
+
+def catalog_marker(connection, schemas=('public',)):
     """
-    Returns a list of view names from the current database's public schema.
+    Returns a value that changes whenever objects in given *schemas* are
+    created, altered or dropped.
+
+    The value is computed from the row count and the highest transaction id
+    of the matching rows in ``pg_class`` and ``pg_type``. Postgresql still
+    has to scan these rows, so this query is not much faster than
+    :func:`introspect` itself. It does, however, return a single row instead
+    of the names of all objects.
     """
-    sql = "SELECT table_name FROM information_schema.tables "\
-        "WHERE table_schema='public' AND table_type='VIEW'"
-    return [name for (name, ) in connection.execute(sql)]
+    return tuple(connection.execute(
+        _catalog_marker_sql, {'schemas': list(schemas)}).one())
 
 
-def list_tables(connection):
+def introspect(connection, schemas=('public',), cache=None):
     """
-    Returns a list of table names from the current database's public schema.
+    Returns a :class:`CatalogSnapshot` of all tables, views, materialized
+    views, sequences and enum types in given *schemas*, which are retrieved
+    from ``pg_catalog`` in a single query.
+
+    If a dict is passed as *cache*, the snapshot is stored there and reused
+    by subsequent calls, as long as the :func:`catalog_marker` of the
+    database does not change. A cache hit avoids transferring and processing
+    the object names, but each call still costs a query scanning the
+    catalog. Callers that know the catalog did not change (during a single
+    startup check, for example) should pass the snapshot around instead.
     """
-    sql = "SELECT table_name FROM information_schema.tables "\
-        "WHERE table_schema='public' AND table_type='BASE TABLE'"
-    return [name for (name, ) in connection.execute(sql)]
+    schemas = tuple(schemas)
+    marker = None
+    if cache is not None:
+        marker = catalog_marker(connection, schemas)
+        snapshot = cache.get(schemas)
+        if snapshot is not None and snapshot.marker == marker:
+            return snapshot
+    objects = dict((member, []) for member in set(_relkinds.values()))
+    result = connection.execute(_catalog_sql, {'schemas': list(schemas)})
+    for schema, name, kind in result:
+        objects[_relkinds[kind]].append((schema, name))
+    snapshot = CatalogSnapshot(marker=marker, **objects)
+    if cache is not None:
+        cache[schemas] = snapshot
+    return snapshot
 
 
-def list_sequences(connection):
+def list_views(connection, schema='public'):
     """
-    Returns a list of the sequence names from the current
-    database's public schema.
+    Returns a list of view names from given *schema*.
     """
-    sql = "SELECT sequence_name FROM information_schema.sequences "\
-        "WHERE sequence_schema='public'"
-    return [name for (name, ) in connection.execute(sql)]
+    return [name for (_, name) in introspect(connection, (schema,)).views]
 
 
-def list_enum_types(connection):
+def list_tables(connection, schema='public'):
+    """
+    Returns a list of table names from given *schema*.
     """
-    Returns a list of enum type names from the current database.
+    return [name for (_, name) in introspect(connection, (schema,)).tables]
+
+
+def list_sequences(connection, schema='public'):
     """
-    sql = "SELECT typname FROM pg_type WHERE typtype = 'e'"
+    Returns a list of the sequence names from given *schema*.
+    """
+    return [name for (_, name) in introspect(connection, (schema,)).sequences]
+
+
+def list_enum_types(connection, schema=None):
+    """
+    Returns a list of enum type names from given *schema*, or from all schemas
+    if *schema* is `None`.
+    """
+    if schema is not None:
+        snapshot = introspect(connection, (schema,))
+        return [name for (_, name) in snapshot.enum_types]
+    sql = sa.text("SELECT typname FROM pg_catalog.pg_type WHERE typtype = 'e'")
     return [name for (name, ) in connection.execute(sql)]
 
 
-def destroy(connection, destroyable):
+_enum_labels_sql = sa.text("""
+    SELECT n.nspname, t.typname,
+           array_agg(e.enumlabel::text ORDER BY e.enumsortorder)
+    FROM pg_catalog.pg_type t
+    JOIN pg_catalog.pg_namespace n ON n.oid = t.typnamespace
+    JOIN pg_catalog.pg_enum e ON e.enumtypid = t.oid
+    WHERE t.typname = ANY(:names)
+    GROUP BY n.nspname, t.typname
+""")
+
+
+def create_enum_types(connection, metadata):
+    """
+    Creates all native enum types used by :class:`score.sa.db.EnumType`
+    columns in given *metadata*, using a single catalog query and a single
+    batch of DDL statements. Enum types that already exist are verified to
+    contain the expected values; a :class:`ValueError` is raised on mismatch.
+
+    Use this in combination with :meth:`score.sa.db.Enum.db_type` with a falsy
+    *create_type* to avoid the per-type existence checks performed by
+    :meth:`sqlalchemy.schema.MetaData.create_all`.
+
+    The DDL statements are sent as a single parameterless ``DO`` block, which
+    works with all postgresql drivers supported by SQLAlchemy (psycopg2,
+    psycopg, pg8000 and asyncpg), including those that cannot execute
+    multiple statements at once. The types are created in the connection's
+    current transaction, which must be committed by the caller.
+    """
+    from ._enum import EnumType
+    enum_types = dict()
+    for table in metadata.tables.values():
+        for column in table.columns:
+            if isinstance(column.type, EnumType):
+                impl = column.type.impl
+                enum_types[(impl.schema, impl.name)] = impl.enums
+    if not enum_types:
+        return
+    current_schema = connection.execute(
+        sa.text("SELECT current_schema()")).scalar()
+    names = list(set(name for (_, name) in enum_types))
+    existing = dict(
+        ((schema, name), list(labels))
+        for schema, name, labels in connection.execute(
+            _enum_labels_sql, {'names': names}))
+    quote = connection.dialect.identifier_preparer.quote
+    statements = []
+    for (schema, name), values in enum_types.items():
+        key = (schema or current_schema, name)
+        if key in existing:
+            if existing[key] != list(values):
+                raise ValueError(
+                    'Enum type %s.%s has values %r, expected %r'
+                    % (key[0], name, existing[key], list(values)))
+            continue
+        qualified_name = quote(name)
+        if schema:
+            qualified_name = '%s.%s' % (quote(schema), qualified_name)
+        statements.append('CREATE TYPE %s AS ENUM (%s)' % (
+            qualified_name,
+            ', '.join("'%s'" % value.replace("'", "''") for value in values)))
+    if statements:
+        log.debug('Creating %d enum types', len(statements))
+        body = ';\n'.join(statements)
+        tag = '$score$'
+        counter = 0
+        while tag in body:
+            counter += 1
+            tag = '$score%d$' % counter
+        connection.exec_driver_sql(
+            'DO %s BEGIN\n%s;\nEND %s' % (tag, body, tag),
+            execution_options={'no_parameters': True})
+
+
+def destroy(connection, destroyable, schemas=('public',)):
     """
     Drops everything in the database – tables, views, sequences, etc. For
     safety reasons, the *destroyable* flag of the database
     :class:`configuration <score.sa.db.ConfiguredSaDbModule>` must be passed as
     parameter.
+
+    Only objects in given *schemas* are dropped.
     """
     assert destroyable
-    with transaction.manager:
-        for seq in list_sequences(connection):
-            connection.execute('DROP SEQUENCE "%s" CASCADE' % seq)
-        for view in list_views(connection):
-            connection.execute('DROP VIEW "%s" CASCADE' % view)
-        for enum_type in list_enum_types(connection):
-            connection.execute('DROP TYPE "%s" CASCADE' % enum_type)
-        for table in list_tables(connection):
-            connection.execute('DROP TABLE "%s" CASCADE' % table)
+    quote = connection.dialect.identifier_preparer.quote
+
+    def drop(kind, schema, name):
+        connection.execute(sa.text('DROP %s IF EXISTS %s.%s CASCADE' % (
+            kind, quote(schema), quote(name))))
+
+    transaction = connection.begin()
+    try:
+        snapshot = introspect(connection, schemas)
+        for schema, seq in snapshot.sequences:
+            drop('SEQUENCE', schema, seq)
+        for schema, view in snapshot.views:
+            drop('VIEW', schema, view)
+        for schema, view in snapshot.materialized_views:
+            drop('MATERIALIZED VIEW', schema, view)
+        for schema, enum_type in snapshot.enum_types:
+            drop('TYPE', schema, enum_type)
+        for schema, table in snapshot.tables:
+            drop('TABLE', schema, table)
+        transaction.commit()
+    except:
+        transaction.rollback()
+        raise
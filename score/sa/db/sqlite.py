@@ -26,6 +26,9 @@
 # the Licensee has his registered seat, an establishment or assets.
 
 
+import os
+import time
+
 import sqlalchemy as sa
 
 
@@ -76,3 +79,91 @@ def destroy(connection, destroyable):
     except:
         transaction.rollback()
         raise
+
+
+class SingleWriter:
+    """
+    Serializes write transactions on an SQLite database through a single
+    dedicated writer connection, while readers use a separate pool of
+    read-only connections in WAL mode.
+
+    The writer engine's pool holds exactly one connection and thus acts as an
+    in-process queue: every thread wanting to write waits for its turn to check
+    out the connection. If a *lock_file* is given, the checked out connection
+    additionally holds an exclusive :func:`fcntl.flock` on that file, which
+    serializes writers across processes as well. Transactions on the writer
+    connection are started with ``BEGIN IMMEDIATE``, so SQLite acquires its
+    write lock up front instead of failing with ``SQLITE_BUSY`` in the middle
+    of a transaction.
+
+    The *config* is passed to :func:`score.sa.db.engine_from_config` for both
+    engines. *timeout* is the number of seconds to wait for the writer
+    connection (and for the *lock_file*, if configured) before raising
+    :class:`sqlalchemy.exc.TimeoutError`.
+    """
+
+    def __init__(self, config, *, lock_file=None, timeout=30):
+        from ._init import engine_from_config
+        url = sa.engine.make_url(config['sqlalchemy.url'])
+        if url.get_backend_name() != 'sqlite':
+            raise ValueError('Single writer mode requires an sqlite database')
+        if not url.database or url.database == ':memory:':
+            raise ValueError(
+                'Single writer mode cannot be used with in-memory databases')
+        self.lock_file = lock_file
+        self.timeout = timeout
+        self._lock_fd = None
+        self.writer_engine = engine_from_config(
+            config, poolclass=sa.pool.QueuePool, pool_size=1, max_overflow=0,
+            pool_timeout=timeout)
+        self.read_engine = engine_from_config(config)
+        sa.event.listen(self.writer_engine, 'connect', self._on_writer_connect)
+        sa.event.listen(self.writer_engine, 'begin', self._on_writer_begin)
+        sa.event.listen(self.read_engine, 'connect', self._on_reader_connect)
+        if lock_file:
+            sa.event.listen(self.writer_engine.pool, 'checkout',
+                            self._acquire_file_lock)
+            sa.event.listen(self.writer_engine.pool, 'checkin',
+                            self._release_file_lock)
+
+    def _on_writer_connect(self, dbapi_connection, connection_record):
+        # disable pysqlite's own transaction handling, so we can emit our own
+        # BEGIN IMMEDIATE in _on_writer_begin()
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.close()
+
+    def _on_writer_begin(self, connection):
+        connection.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def _on_reader_connect(self, dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA query_only=ON")
+        cursor.close()
+
+    def _acquire_file_lock(self, dbapi_connection, connection_record,
+                           connection_proxy):
+        import fcntl
+        from ._init import _checkout_timeout
+        if self._lock_fd is None:
+            self._lock_fd = os.open(self.lock_file, os.O_RDWR | os.O_CREAT)
+        end = time.monotonic() + _checkout_timeout(self.timeout)
+        delay = 0.001
+        while True:
+            try:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return
+            except BlockingIOError:
+                remaining = end - time.monotonic()
+                if remaining <= 0:
+                    raise sa.exc.TimeoutError(
+                        'Timed out waiting for lock file %s' % self.lock_file)
+                time.sleep(min(delay, remaining))
+                delay = min(delay * 2, 0.05)
+
+    def _release_file_lock(self, dbapi_connection, connection_record):
+        import fcntl
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
@@ -0,0 +1,201 @@
+# Copyright © 2017,2018 STRG.AT GmbH, Vienna, Austria
+# Copyright © 2019-2023 Necdet Can Ateşman, Vienna, Austria
+#
+# This file is part of the The SCORE Framework.
+#
+# The SCORE Framework and all its parts are free software: you can redistribute
+# them and/or modify them under the terms of the GNU Lesser General Public
+# License version 3 as published by the Free Software Foundation which is in
+# the file named COPYING.LESSER.txt.
+#
+# The SCORE Framework and all its parts are distributed without any WARRANTY;
+# without even the implied warranty of MERCHANTABILITY or FITNESS FOR A
+# PARTICULAR PURPOSE. For more details see the GNU Lesser General Public
+# License.
+#
+# If you have not received a copy of the GNU Lesser General Public License see
+# http://www.gnu.org/licenses/.
+#
+# The License-Agreement realised between you as Licensee and STRG.AT GmbH as
+# Licenser including the issue of its valid conclusion and its pre- and
+# post-contractual effects is governed by the laws of Austria. Any disputes
+# concerning this License-Agreement including the issue of its valid conclusion
+# and its pre- and post-contractual effects are exclusively decided by the
+# competent court, in whose district STRG.AT GmbH has its registered seat, at
+# the discretion of STRG.AT GmbH also the competent court, in whose district
+# the Licensee has his registered seat, an establishment or assets.
+
+"""
+Provides helpers for load testing applications on a local database. Local
+databases answer in microseconds, which hides pool exhaustion and timeout
+issues, that only show up on production systems. The :class:`LatencyInjector`
+slows down an engine to production-like levels and :func:`load_test` drives
+concurrent contexts through a configured module:
+
+>>> injector = LatencyInjector(latency=0.005, jitter=0.002, failure_rate=0.01)
+>>> injector.install(score.db.engine)
+>>> def work(connection):
+...     connection.execute(sa.text('SELECT 1'))
+...
+>>> result = load_test(score.db, work, concurrency=20, iterations=50)
+>>> result.throughput, result.percentiles[99]
+"""
+
+import collections
+import random
+import threading
+import time
+
+import sqlalchemy as sa
+
+
+class InjectedFailure(Exception):
+    """
+    The DBAPI-level error raised (wrapped in an
+    :class:`sqlalchemy.exc.OperationalError`) by a :class:`LatencyInjector`.
+    """
+
+
+class LatencyInjector:
+    """
+    Injects artificial latency and failures into all connections of an
+    :class:`sqlalchemy.engine.Engine`:
+
+    - *latency* seconds are added to every statement execution, varied
+      randomly by up to *jitter* seconds in either direction,
+    - *connect_delay* seconds are added whenever the pool opens a new DBAPI
+      connection,
+    - a fraction of *failure_rate* (between 0 and 1) of all executions and
+      connection attempts fail with an :class:`sqlalchemy.exc.OperationalError`
+      wrapping an :class:`InjectedFailure`.
+
+    The delays happen while the connection is checked out of the pool, so the
+    pool behaves as if it was talking to a slow database. Pass a *seed* to get
+    reproducible failures.
+    """
+
+    def __init__(self, latency=0, jitter=0, connect_delay=0, failure_rate=0,
+                 seed=None):
+        if not 0 <= failure_rate <= 1:
+            raise ValueError('failure_rate must be between 0 and 1')
+        self.latency = latency
+        self.jitter = jitter
+        self.connect_delay = connect_delay
+        self.failure_rate = failure_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def install(self, engine):
+        """
+        Registers this injector on given *engine*.
+        """
+        sa.event.listen(engine, 'connect', self._on_connect)
+        sa.event.listen(engine, 'before_cursor_execute', self._on_execute)
+
+    def uninstall(self, engine):
+        """
+        Removes this injector from given *engine*.
+        """
+        sa.event.remove(engine, 'connect', self._on_connect)
+        sa.event.remove(engine, 'before_cursor_execute', self._on_execute)
+
+    def _roll(self):
+        with self._lock:
+            return self._random.random(), self._random.uniform(-1, 1)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        failure, _ = self._roll()
+        if self.connect_delay:
+            time.sleep(self.connect_delay)
+        if failure < self.failure_rate:
+            raise sa.exc.OperationalError(
+                None, None, InjectedFailure('Injected connection failure'))
+
+    def _on_execute(self, connection, cursor, statement, parameters, context,
+                    executemany):
+        failure, jitter = self._roll()
+        delay = self.latency + jitter * self.jitter
+        if delay > 0:
+            time.sleep(delay)
+        if failure < self.failure_rate:
+            raise sa.exc.OperationalError(
+                statement, parameters,
+                InjectedFailure('Injected statement failure'))
+
+
+LoadTestResult = collections.namedtuple('LoadTestResult', (
+    'requests', 'errors', 'duration', 'throughput', 'percentiles'))
+LoadTestResult.__doc__ = """
+Result of :func:`load_test`. *duration* is the wall clock time of the whole
+test in seconds and *throughput* the number of successful requests per second.
+*percentiles* maps the percentiles 50, 90, 99 and 100 to the latency of
+successful requests in seconds. *errors* is a :class:`collections.Counter` of
+exception class names.
+"""
+
+
+class _LoadTestContext:
+    """
+    Stand-in for a :class:`score.ctx.Context` object during :func:`load_test`.
+    """
+
+
+def _percentile(sorted_values, percentile):
+    if not sorted_values:
+        return None
+    index = max(0, int(round(percentile / 100 * len(sorted_values))) - 1)
+    return sorted_values[index]
+
+
+def load_test(db, work, *, concurrency=10, iterations=100):
+    """
+    Runs *work* in *concurrency* threads for *iterations* times each and
+    returns a :class:`LoadTestResult`.
+
+    Every run simulates a request: It creates a context connection on the
+    :class:`configured module <score.sa.db.ConfiguredSaDbModule>` *db*, passes
+    it to the callable *work* and closes the connection again, committing or
+    rolling back the context transaction just like a :class:`score.ctx.Context`
+    would. The measured latency includes waiting for a pooled connection.
+    """
+    latencies = []
+    errors = collections.Counter()
+    lock = threading.Lock()
+
+    def run():
+        for _ in range(iterations):
+            ctx = _LoadTestContext()
+            start = time.perf_counter()
+            exception = None
+            try:
+                connection = db._create_connection(ctx)
+                try:
+                    work(connection)
+                except Exception as e:
+                    exception = e
+                db._close_connection(ctx, connection, exception)
+            except Exception as e:
+                exception = e
+            elapsed = time.perf_counter() - start
+            with lock:
+                if exception:
+                    errors[type(exception).__name__] += 1
+                else:
+                    latencies.append(elapsed)
+
+    threads = [threading.Thread(target=run) for _ in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    duration = time.perf_counter() - start
+    latencies.sort()
+    return LoadTestResult(
+        requests=len(latencies) + sum(errors.values()),
+        errors=errors,
+        duration=duration,
+        throughput=len(latencies) / duration if duration else 0,
+        percentiles=dict(
+            (percentile, _percentile(latencies, percentile))
+            for percentile in (50, 90, 99, 100)))
@@ -63,7 +63,7 @@ setup(
     ],
     install_requires=[
         'score.init >= 0.3',
-        'SQLAlchemy >= 0.9',
+        'SQLAlchemy >= 1.4.24',
         'zope.sqlalchemy >= 0.7, < 1.4',
     ],
 )